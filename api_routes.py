@@ -1,130 +1,175 @@
-from flask import Blueprint, request, jsonify, current_app
-from models import Video
-from youtube_service import YouTubeService
+from flask import Blueprint, request, current_app, make_response
+from models import Video, VIDEO_COLUMNS, rows_to_payload
+from youtube_service import youtube_service
 from extensions import db
-from sqlalchemy import or_, desc, text
+from background_fetcher import request_fetch
+from cache_service import cache_service
+from sqlalchemy import and_, or_, desc, text, tuple_, func, literal_column, select
+from datetime import datetime
+from functools import wraps
+import hashlib
 import logging
+import orjson
+import re
 
 api_bp = Blueprint('api', __name__)
 
-youtube_service = YouTubeService()
+def jsonify_fast(obj, status=200):
+    """Build a JSON response with orjson instead of the stdlib encoder"""
+    return current_app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC),
+        status=status,
+        mimetype='application/json'
+    )
+
+def make_pagination(per_page, cursor, next_cursor):
+    """Pagination block shared by the keyset-paginated endpoints"""
+    return {
+        'per_page': per_page,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    }
+
+def conditional(view):
+    """Answer GETs with a weak ETag and return 304 when the client's copy is current"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Requests that trigger a fetch must always reach the view
+        if request.args.get('fetch_new', 'false').lower() == 'true':
+            return view(*args, **kwargs)
+        
+        # Every insert/update bumps updated_at, so its max versions the whole table
+        data_version = db.session.query(func.max(Video.updated_at)).scalar()
+        etag = hashlib.blake2b(f"{data_version}:{request.full_path}".encode(), digest_size=16).hexdigest()
+        
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag, weak=True)
+        return response
+    return wrapper
+
+def parse_cursor(cursor):
+    """Parse a '<iso_published_at>,<id>' keyset cursor into a (datetime, int) tuple"""
+    if not cursor:
+        return None
+    published_at, _, video_pk = cursor.rpartition(',')
+    return datetime.fromisoformat(published_at), int(video_pk)
+
+def paginate_keyset(videos_query, cursor, per_page):
+    """Keyset-paginate a select on (published_at DESC, id DESC) without a COUNT(*)"""
+    if cursor:
+        videos_query = videos_query.where(tuple_(Video.published_at, Video.id) < cursor)
+    
+    # Fetch one extra row to find out whether another page exists
+    rows = db.session.execute(
+        videos_query.order_by(desc(Video.published_at), desc(Video.id)).limit(per_page + 1)
+    ).all()
+    
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = f"{last.published_at.isoformat()},{last.id}"
+    
+    return rows, next_cursor
 
 @api_bp.route('/videos', methods=['GET'])
+@conditional
 def get_videos():
     """Get paginated list of videos sorted by publish date (descending)"""
     try:
         # Get query parameters
-        page = int(request.args.get('page', 1))
-        per_page = min(int(request.args.get('per_page', 20)), 100)  # Max 100 per page
+        cursor = request.args.get('cursor')
+        per_page = max(1, min(int(request.args.get('per_page', 20)), 100))  # 1 to 100 per page
         query = request.args.get('query', 'programming')  # Default search query
         fetch_new = request.args.get('fetch_new', 'false').lower() == 'true'
         
         # Fetch new videos if requested or if database is empty
-        total_videos = Video.query.count()
-        if fetch_new or total_videos == 0:
-            try:
-                result = youtube_service.fetch_videos(query, max_results=50)
-                logging.info(f"Fetched videos result: {result}")
-            except Exception as e:
-                logging.error(f"Error fetching videos from YouTube: {e}")
-                # Continue with existing data if fetch fails
-        
-        # Query videos from database
-        videos_query = Video.query.order_by(desc(Video.published_at))
+        is_empty = db.session.query(Video.id).limit(1).scalar() is None
+        # Hand the fetch to the background fetcher instead of waiting on YouTube
+        fetch_status = None
+        if fetch_new or is_empty:
+            fetch_status = 'queued' if request_fetch(query) else 'unavailable'
         
-        # Paginate results
-        pagination = videos_query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        # Query videos from database, one keyset page at a time
+        try:
+            cursor_key = parse_cursor(cursor)
+        except ValueError:
+            return jsonify_fast({'error': 'Invalid cursor'}, 400)
+        
+        items, next_cursor = paginate_keyset(select(*VIDEO_COLUMNS), cursor_key, per_page)
         
-        videos = [video.to_dict() for video in pagination.items]
+        videos = rows_to_payload(items)
         
-        return jsonify({
+        return jsonify_fast({
             'videos': videos,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev,
-                'next_page': page + 1 if pagination.has_next else None,
-                'prev_page': page - 1 if pagination.has_prev else None
-            },
-            'query': query
+            'pagination': make_pagination(per_page, cursor, next_cursor),
+            'query': query,
+            'fetch_status': fetch_status
         })
         
     except Exception as e:
         logging.error(f"Error in get_videos: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify_fast({'error': str(e)}, 500)
 
 @api_bp.route('/videos/search', methods=['GET'])
+@conditional
 def search_videos():
     """Search videos by title and description with partial matching"""
     try:
         # Get query parameters
         search_query = request.args.get('q', '').strip()
-        page = int(request.args.get('page', 1))
-        per_page = min(int(request.args.get('per_page', 20)), 100)
+        cursor = request.args.get('cursor')
+        per_page = max(1, min(int(request.args.get('per_page', 20)), 100))
         
         if not search_query:
-            return jsonify({'error': 'Search query parameter "q" is required'}), 400
-        
-        # Split search query into words for partial matching
-        search_words = search_query.split()
-        
-        # Build search conditions for partial matching
-        search_conditions = []
-        for word in search_words:
-            word_pattern = f'%{word}%'
-            search_conditions.append(
-                or_(
-                    Video.title.ilike(word_pattern),
-                    Video.description.ilike(word_pattern)
+            return jsonify_fast({'error': 'Search query parameter "q" is required'}, 400)
+        
+        try:
+            cursor_key = parse_cursor(cursor)
+        except ValueError:
+            return jsonify_fast({'error': 'Invalid cursor'}, 400)
+        
+        if db.engine.dialect.name == 'postgresql':
+            # Use the GIN-indexed search_vector column, prefix-matching every word
+            ts_terms = re.findall(r'\w+', search_query)
+            if ts_terms:
+                ts_query = ' & '.join(f'{term}:*' for term in ts_terms)
+                videos_query = select(*VIDEO_COLUMNS).where(
+                    literal_column('video.search_vector').op('@@')(func.to_tsquery('english', ts_query))
                 )
-            )
-        
-        # Combine all conditions with AND (all words must match somewhere)
-        if search_conditions:
-            combined_condition = search_conditions[0]
-            for condition in search_conditions[1:]:
-                combined_condition = combined_condition & condition
-            
-            # Query videos with search conditions
-            videos_query = Video.query.filter(combined_condition).order_by(desc(Video.published_at))
+            else:
+                videos_query = select(*VIDEO_COLUMNS).where(Video.id == -1)
         else:
-            # If no search conditions, return empty results
-            videos_query = Video.query.filter(Video.id == -1).order_by(desc(Video.published_at))
+            # Split search query into words for partial matching
+            search_patterns = [f'%{word}%' for word in search_query.split()]
+            
+            # All words must match somewhere, built as one flat AND of ORs
+            videos_query = select(*VIDEO_COLUMNS).where(and_(*(
+                or_(Video.title.ilike(pattern), Video.description.ilike(pattern))
+                for pattern in search_patterns
+            )))
         
         # Paginate results
-        pagination = videos_query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        items, next_cursor = paginate_keyset(videos_query, cursor_key, per_page)
         
-        videos = [video.to_dict() for video in pagination.items]
+        videos = rows_to_payload(items)
         
-        return jsonify({
+        return jsonify_fast({
             'videos': videos,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev,
-                'next_page': page + 1 if pagination.has_next else None,
-                'prev_page': page - 1 if pagination.has_prev else None
-            },
+            'pagination': make_pagination(per_page, cursor, next_cursor),
             'search_query': search_query
         })
         
     except Exception as e:
         logging.error(f"Error in search_videos: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify_fast({'error': str(e)}, 500)
 
 @api_bp.route('/videos/fetch', methods=['POST'])
 def fetch_new_videos():
@@ -134,39 +179,49 @@ def fetch_new_videos():
         query = data.get('query', 'programming')
         max_results = min(data.get('max_results', 50), 50)
         
-        result = youtube_service.fetch_videos(query, max_results)
+        # Always ask YouTube rather than serving cached results, and respond once the videos
+        # are fetched; they are stored in the background
+        result = youtube_service.fetch_videos(query, max_results, wait_for_storage=False, use_cache=False)
+        # A 304 from YouTube means the stored videos are already current, so nothing is being stored
+        fetch_status = 'unchanged' if result.get('unchanged') else 'storing'
         
-        return jsonify({
+        return jsonify_fast({
             'message': 'Videos fetched successfully',
-            'stored_count': result.get('stored_count', 0),
             'total_fetched': len(result.get('items', [])),
-            'query': query
+            'query': query,
+            'fetch_status': fetch_status
         })
         
     except Exception as e:
         logging.error(f"Error in fetch_new_videos: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify_fast({'error': str(e)}, 500)
 
 @api_bp.route('/stats', methods=['GET'])
+@conditional
 def get_stats():
     """Get basic statistics about stored videos"""
     try:
-        total_videos = Video.query.count()
-        
-        # Get latest video
-        latest_video = Video.query.order_by(desc(Video.published_at)).first()
-        latest_published = latest_video.published_at.isoformat() if latest_video else None
-        
-        # Get oldest video
-        oldest_video = Video.query.order_by(Video.published_at).first()
-        oldest_published = oldest_video.published_at.isoformat() if oldest_video else None
-        
-        return jsonify({
-            'total_videos': total_videos,
-            'latest_published': latest_published,
-            'oldest_published': oldest_published
-        })
+        stats = cache_service.get_stats()
+        if stats:
+            return jsonify_fast(stats)
+        
+        # Count plus latest/oldest publish dates in a single round-trip
+        row = db.session.execute(select(
+            select(func.count(Video.id)).scalar_subquery().label('total_videos'),
+            select(Video.published_at).order_by(desc(Video.published_at)).limit(1).scalar_subquery().label('latest'),
+            select(Video.published_at).order_by(Video.published_at).limit(1).scalar_subquery().label('oldest')
+        )).one()
+        
+        # Datetimes are left to orjson, so they carry the same UTC offset as the list endpoints
+        stats = {
+            'total_videos': row.total_videos,
+            'latest_published': row.latest,
+            'oldest_published': row.oldest
+        }
+        cache_service.set_stats(stats)
+        
+        return jsonify_fast(stats)
         
     except Exception as e:
         logging.error(f"Error in get_stats: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify_fast({'error': str(e)}, 500)
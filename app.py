@@ -18,7 +18,19 @@ app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    # Room for the per-word-count variants of the search statement
+    "query_cache_size": 1200,
 }
+if database_url.startswith("postgresql"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        # Send executemany() INSERT/UPDATE batches in a few round-trips instead of one per row
+        "executemany_mode": "values_plus_batch",
+        # Sized for request threads plus the background fetcher's worker pool
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+    })
 
 # Initialize the app with the extension
 db.init_app(app)
@@ -38,19 +50,51 @@ with app.app_context():
         inspector = inspect(db.engine)
         existing_indexes = [idx['name'] for idx in inspector.get_indexes('video')]
         
-        if 'idx_video_published_at' not in existing_indexes:
-            db.session.execute(text("CREATE INDEX idx_video_published_at ON video(published_at DESC)"))
-        if 'idx_video_title' not in existing_indexes:
-            db.session.execute(text("CREATE INDEX idx_video_title ON video(title)"))
-        if 'idx_video_description' not in existing_indexes:
-            db.session.execute(text("CREATE INDEX idx_video_description ON video(description)"))
-        if 'idx_video_video_id' not in existing_indexes:
-            db.session.execute(text("CREATE INDEX idx_video_video_id ON video(video_id)"))
+        # Matches the keyset ORDER BY of the list endpoints
+        if 'idx_video_pub_id' not in existing_indexes:
+            db.session.execute(text("CREATE INDEX idx_video_pub_id ON video(published_at DESC, id DESC)"))
+        
+        # Superseded indexes: b-tree on title/description can't serve ILIKE '%word%',
+        # video_id is covered by its unique constraint and published_at by idx_video_pub_id
+        for index_name in ('ix_video_published_at', 'idx_video_published_at', 'idx_video_title', 'idx_video_description', 'idx_video_video_id'):
+            if index_name in existing_indexes:
+                db.session.execute(text(f"DROP INDEX {index_name}"))
+        if 'idx_video_updated_at' not in existing_indexes:
+            db.session.execute(text("CREATE INDEX idx_video_updated_at ON video(updated_at)"))
+        
+        # Full-text search support (PostgreSQL only, SQLite falls back to ILIKE)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text(
+                "ALTER TABLE video ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))) STORED"
+            ))
+            if 'idx_video_search_vector' not in existing_indexes:
+                db.session.execute(text("CREATE INDEX idx_video_search_vector ON video USING GIN(search_vector)"))
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         logging.warning(f"Index creation failed (may already exist): {e}")
 
+    # Upserts need unique api_key_hash/query columns, which databases created before them lack
+    try:
+        inspector = inspect(db.engine)
+        for table, column, index_name in (
+            ('api_key_usage', 'api_key_hash', 'idx_api_key_usage_hash'),
+            ('search_cache', 'query', 'idx_search_cache_query_unique'),
+        ):
+            has_unique = (
+                any(uc['column_names'] == [column] for uc in inspector.get_unique_constraints(table))
+                or any(idx['unique'] and idx['column_names'] == [column] for idx in inspector.get_indexes(table))
+            )
+            if not has_unique:
+                # Keep only the newest row per value so the unique index can be built
+                db.session.execute(text(f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {column})"))
+                db.session.execute(text(f"CREATE UNIQUE INDEX {index_name} ON {table}({column})"))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.warning(f"Unique index creation failed: {e}")
+
 # Register blueprints
 from api_routes import api_bp
 from dashboard_routes import dashboard_bp
@@ -1,24 +1,38 @@
+import queue
 import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from youtube_service import YouTubeService
+from youtube_service import youtube_service, SEARCH_RESULTS_TTL
+from cache_service import cache_service
 from app import app, db
 
 class BackgroundVideoFetcher:
-    def __init__(self, search_queries=None, fetch_interval=10):
+    def __init__(self, search_queries=None, fetch_interval=10, max_concurrent_fetches=4):
         """
         Initialize background video fetcher
         
         Args:
             search_queries (list): List of search queries to fetch videos for
             fetch_interval (int): Interval in seconds between fetches
+            max_concurrent_fetches (int): Number of queries fetched in parallel per interval
         """
-        self.search_queries = search_queries or ["programming", "technology", "coding", "software development"]
+        # dict.fromkeys drops duplicate queries while keeping their order
+        self.search_queries = list(dict.fromkeys(search_queries or ["programming", "technology", "coding", "software development"]))
         self.fetch_interval = fetch_interval
-        self.youtube_service = YouTubeService()
+        self.max_concurrent_fetches = max_concurrent_fetches
+        # Interval between fetches of one query while it keeps finding new videos, matching a full
+        # round-robin pass over all queries but no shorter than the search-results cache lifetime,
+        # since scheduled fetches read that cache and would otherwise mostly hit it
+        self.base_query_interval = max(fetch_interval * len(self.search_queries) / max_concurrent_fetches, SEARCH_RESULTS_TTL)
+        self.use_schedule = False
+        self.executor = None
         self.running = False
         self.thread = None
+        self.query_index = 0
+        self.priority_queries = queue.Queue()
+        self._wakeup = threading.Event()
         
     def start(self):
         """Start the background fetching thread"""
@@ -27,6 +41,10 @@ class BackgroundVideoFetcher:
             return
             
         self.running = True
+        # Schedule queries in Redis when available, otherwise rotate through them in order
+        self.use_schedule = cache_service.redis_client is not None
+        cache_service.schedule_queries(self.search_queries)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent_fetches, thread_name_prefix="video-fetch")
         self.thread = threading.Thread(target=self._fetch_loop, daemon=True)
         self.thread.start()
         logging.info(f"Started background video fetcher with {len(self.search_queries)} queries, interval: {self.fetch_interval}s")
@@ -34,47 +52,112 @@ class BackgroundVideoFetcher:
     def stop(self):
         """Stop the background fetching thread"""
         self.running = False
+        self._wakeup.set()
         if self.thread:
             self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
         logging.info("Stopped background video fetcher")
         
+    def request_query(self, query):
+        """Queue a query to be fetched ahead of the regular rotation"""
+        self.priority_queries.put(query)
+        self._wakeup.set()
+        
+    def _next_query(self):
+        """Pick the next query to fetch, from the Redis schedule when available or else round-robin
+
+        Returns (query, requested), requested being True for queries queued through the API.
+        """
+        # Queries requested through the API jump ahead of the rotation
+        try:
+            return self.priority_queries.get_nowait(), True
+        except queue.Empty:
+            pass
+            
+        if self.use_schedule:
+            return cache_service.pop_due_query(), False
+            
+        # Without Redis there is no back-off state to consult, so every query gets its turn
+        query = self.search_queries[self.query_index % len(self.search_queries)]
+        self.query_index += 1
+        return query, False
+        
+    def _next_queries(self):
+        """Pick up to max_concurrent_fetches distinct (query, requested) pairs for the next interval"""
+        queries = {}
+        while len(queries) < self.max_concurrent_fetches:
+            query, requested = self._next_query()
+            if query is None:
+                break
+            if query in queries:
+                # Already fetching it this interval, leave it due for the next one
+                cache_service.schedule_queries([query])
+                break
+            queries[query] = requested
+        return list(queries.items())
+        
+    def _fetch_query(self, query, requested=False):
+        """Fetch videos for one query on a worker thread, bypassing cached results if requested"""
+        # Stays None unless the API was actually called, so cache hits and errors don't back off
+        new_videos_count = None
+        try:
+            # Use app context for database operations
+            with app.app_context():
+                logging.info(f"Background fetch starting for query: '{query}'")
+                
+                result = youtube_service.fetch_videos(
+                    query=query,
+                    max_results=25,  # Smaller batch for continuous fetching
+                    use_cache=not requested
+                )
+                stored_count = result.get('stored_count', 0)
+                
+                if not result.get('cached'):
+                    new_videos_count = stored_count
+                
+                if stored_count > 0:
+                    logging.info(f"Background fetch stored {stored_count} new videos for query: '{query}'")
+                else:
+                    logging.debug(f"Background fetch: No new videos for query: '{query}'")
+        finally:
+            if self.use_schedule and query in self.search_queries:
+                cache_service.reschedule_query(query, new_videos_count, self.base_query_interval)
+        
     def _fetch_loop(self):
         """Main fetching loop that runs in background thread"""
-        query_index = 0
-        
         while self.running:
-            try:
-                # Use app context for database operations
-                with app.app_context():
-                    # Rotate through search queries
-                    current_query = self.search_queries[query_index % len(self.search_queries)]
-                    query_index += 1
-                    
-                    logging.info(f"Background fetch starting for query: '{current_query}'")
-                    
-                    # Fetch videos for current query
-                    result = self.youtube_service.fetch_videos(
-                        query=current_query,
-                        max_results=25  # Smaller batch for continuous fetching
-                    )
-                    
-                    if result.get('stored_count', 0) > 0:
-                        logging.info(f"Background fetch stored {result['stored_count']} new videos for query: '{current_query}'")
+            queries = self._next_queries()
+            if not queries:
+                logging.debug("Background fetch: no queries due")
+            
+            # Overlap the YouTube round-trips of this interval's queries
+            futures = [
+                (query, self.executor.submit(self._fetch_query, query, requested))
+                for query, requested in queries
+            ]
+            
+            quota_exhausted = False
+            for query, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    error_msg = str(e).lower()
+                    if "exhausted" in error_msg or "quota" in error_msg:
+                        quota_exhausted = True
                     else:
-                        logging.debug(f"Background fetch: No new videos for query: '{current_query}'")
+                        logging.error(f"Error in background fetch for query '{query}': {e}")
                         
-            except Exception as e:
-                error_msg = str(e).lower()
-                if "exhausted" in error_msg or "quota" in error_msg:
-                    logging.warning(f"All API keys exhausted. Pausing background fetching for 1 hour.")
-                    # Sleep for 1 hour when quota is exhausted
-                    time.sleep(3600)  # 1 hour = 3600 seconds
-                    continue
-                else:
-                    logging.error(f"Error in background fetch for query '{current_query}': {e}")
+            if quota_exhausted:
+                logging.warning(f"All API keys exhausted. Pausing background fetching for 1 hour.")
+                # Sleep for 1 hour when quota is exhausted
+                time.sleep(3600)  # 1 hour = 3600 seconds
+                continue
                 
-            # Wait for next fetch interval
-            time.sleep(self.fetch_interval)
+            # Wait for next fetch interval, waking early for requested queries
+            if self.priority_queries.empty():
+                self._wakeup.wait(self.fetch_interval)
+            self._wakeup.clear()
 
 # Global instance of background fetcher
 background_fetcher = None
@@ -178,6 +261,13 @@ def start_background_fetching():
         
     background_fetcher.start()
     
+def request_fetch(query):
+    """Ask the background fetcher to fetch a query next, returns False if it isn't running"""
+    if background_fetcher is None or not background_fetcher.running:
+        return False
+    background_fetcher.request_query(query)
+    return True
+
 def stop_background_fetching():
     """Stop background video fetching"""
     global background_fetcher
@@ -2,20 +2,49 @@
 Redis cache service for YouTube video data
 """
 import redis
-import json
+import msgpack
 import logging
 import hashlib
-from datetime import datetime, timedelta
+import calendar
+import math
+import random
+import time
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 
 logger = logging.getLogger(__name__)
 
+def _pack_default(obj: Any) -> Any:
+    """Pack naive datetimes (UTC throughout the app) as timestamps too, and anything else as str"""
+    if isinstance(obj, datetime):
+        return obj.replace(tzinfo=timezone.utc)
+    return str(obj)
+
+def _pack(data: Any) -> bytes:
+    """Serialize a cache value to MessagePack, with datetimes as MessagePack timestamps"""
+    return msgpack.packb(data, use_bin_type=True, datetime=True, default=_pack_default)
+
+def _unpack(raw: bytes) -> Any:
+    """Deserialize a MessagePack cache value, restoring timestamps as UTC datetimes"""
+    return msgpack.unpackb(raw, raw=False, timestamp=3)
+
 class CacheService:
     """Redis-based caching service for YouTube data"""
     
     def __init__(self, host='localhost', port=6379, db=0):
+        self._midnight_date = None
+        self._next_midnight = 0
         try:
-            self.redis_client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
+            # Shared, bounded pool of keep-alive connections for all request and background threads
+            self.pool = redis.ConnectionPool(
+                host=host,
+                port=port,
+                db=db,
+                max_connections=32,
+                socket_keepalive=True
+            )
+            self.redis_client = redis.Redis(connection_pool=self.pool)
             # Test connection
             self.redis_client.ping()
             logger.info("Redis cache service initialized successfully")
@@ -23,14 +52,16 @@ class CacheService:
             logger.error("Failed to connect to Redis server")
             self.redis_client = None
     
-    def _get_cache_key(self, prefix: str, query: str, **kwargs) -> str:
-        """Generate consistent cache key"""
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _get_cache_key(prefix: str, query: str, **kwargs) -> str:
+        """Generate consistent cache key, memoized since the query set is small and repetitive"""
         key_data = f"{query}:{':'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))}"
-        hash_key = hashlib.md5(key_data.encode()).hexdigest()[:8]
+        hash_key = hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
         return f"{prefix}:{hash_key}"
     
-    def cache_search_results(self, query: str, results: Dict[str, Any], expiry_hours: int = 2):
-        """Cache YouTube search results"""
+    def cache_search_results(self, query: str, results: Dict[str, Any], ttl: int = 600):
+        """Cache YouTube search results, briefly since they go stale as new videos are published"""
         if not self.redis_client:
             return
             
@@ -45,8 +76,8 @@ class CacheService:
             
             self.redis_client.setex(
                 cache_key,
-                timedelta(hours=expiry_hours),
-                json.dumps(cache_data, default=str)
+                ttl,
+                _pack(cache_data)
             )
             logger.debug(f"Cached search results for query: {query}")
             
@@ -62,112 +93,173 @@ class CacheService:
             cache_key = self._get_cache_key("search", query)
             cached_data = self.redis_client.get(cache_key)
             
+            # Freshness is enforced by the key's TTL
             if cached_data:
-                data = json.loads(str(cached_data))
-                cached_at = datetime.fromisoformat(data['cached_at'])
-                
-                # Check if cache is still fresh (within last 2 hours for active queries)
-                if datetime.utcnow() - cached_at < timedelta(hours=2):
-                    logger.debug(f"Retrieved cached search results for query: {query}")
-                    return data['results']
+                logger.debug(f"Retrieved cached search results for query: {query}")
+                return _unpack(cached_data)['results']
                     
         except Exception as e:
             logger.error(f"Error retrieving cached search results: {e}")
             
         return None
     
-    def cache_video_details(self, video_ids: List[str], details: Dict[str, Any], expiry_hours: int = 24):
-        """Cache video detail information"""
-        if not self.redis_client or not video_ids:
+    def cache_search_etag(self, query: str, page_token: Optional[str], etag: str, result: Dict[str, Any], ttl: int):
+        """Remember a search page's ETag with the result built from it, for conditional requests"""
+        if not self.redis_client:
             return
             
         try:
-            cache_key = self._get_cache_key("videos", ",".join(sorted(video_ids)))
-            cache_data = {
-                'video_ids': video_ids,
-                'details': details,
-                'cached_at': datetime.utcnow().isoformat()
-            }
-            
-            self.redis_client.setex(
-                cache_key,
-                timedelta(hours=expiry_hours),
-                json.dumps(cache_data, default=str)
-            )
-            logger.debug(f"Cached details for {len(video_ids)} videos")
+            cache_key = self._get_cache_key("etag", query, page_token=page_token)
+            self.redis_client.setex(cache_key, ttl, _pack({'etag': etag, 'result': result}))
             
         except Exception as e:
-            logger.error(f"Error caching video details: {e}")
+            logger.error(f"Error caching search ETag: {e}")
     
-    def get_cached_video_details(self, video_ids: List[str]) -> Optional[Dict[str, Any]]:
-        """Get cached video details"""
-        if not self.redis_client or not video_ids:
+    def get_search_etag(self, query: str, page_token: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get the last ETag and result for a search page"""
+        if not self.redis_client:
             return None
             
         try:
-            cache_key = self._get_cache_key("videos", ",".join(sorted(video_ids)))
-            cached_data = self.redis_client.get(cache_key)
-            
+            cached_data = self.redis_client.get(self._get_cache_key("etag", query, page_token=page_token))
             if cached_data:
-                data = json.loads(str(cached_data))
-                cached_at = datetime.fromisoformat(data['cached_at'])
+                return _unpack(cached_data)
                 
-                # Video details can be cached longer (24 hours)
-                if datetime.utcnow() - cached_at < timedelta(hours=24):
-                    logger.debug(f"Retrieved cached details for {len(video_ids)} videos")
-                    return data['details']
-                    
         except Exception as e:
-            logger.error(f"Error retrieving cached video details: {e}")
+            logger.error(f"Error retrieving search ETag: {e}")
             
         return None
     
-    def should_skip_query(self, query: str, hours_threshold: int = 6) -> bool:
-        """Check if query was recently processed and returned few results"""
+    def should_refresh_early(self, query: str, beta: float = 1.0, window_seconds: int = 60) -> bool:
+        """XFetch-style early refresh, increasingly likely as cached search results near expiry"""
         if not self.redis_client:
             return False
             
         try:
-            skip_key = f"skip:{query}"
-            skip_data = self.redis_client.get(skip_key)
-            
-            if skip_data:
-                data = json.loads(str(skip_data))
-                last_attempt = datetime.fromisoformat(data['last_attempt'])
+            ttl = self.redis_client.ttl(self._get_cache_key("search", query))
+            if ttl > 0:
+                return -window_seconds * beta * math.log(1.0 - random.random()) >= ttl
                 
-                # Skip if recent attempt had no new videos
-                if (datetime.utcnow() - last_attempt < timedelta(hours=hours_threshold) 
-                    and data['new_videos'] == 0):
-                    logger.debug(f"Skipping query '{query}' - no new videos in last {hours_threshold} hours")
-                    return True
-                    
         except Exception as e:
-            logger.error(f"Error checking skip status: {e}")
+            logger.error(f"Error checking early refresh: {e}")
             
         return False
     
-    def mark_query_processed(self, query: str, new_videos_count: int):
-        """Mark query as processed with result count"""
+    def acquire_refresh_lock(self, query: str, ttl: int = 5) -> bool:
+        """Take the short-lived lock that lets a single worker refresh a query"""
+        if not self.redis_client:
+            return True
+            
+        try:
+            lock_key = f"lock:{self._get_cache_key('search', query)}"
+            return bool(self.redis_client.set(lock_key, 1, nx=True, ex=ttl))
+            
+        except Exception as e:
+            logger.error(f"Error acquiring refresh lock: {e}")
+            
+        return True
+    
+    def release_refresh_lock(self, query: str):
+        """Release the refresh lock for a query"""
         if not self.redis_client:
             return
             
         try:
-            skip_key = f"skip:{query}"
-            skip_data = {
-                'query': query,
-                'last_attempt': datetime.utcnow().isoformat(),
-                'new_videos': new_videos_count
+            self.redis_client.delete(f"lock:{self._get_cache_key('search', query)}")
+            
+        except Exception as e:
+            logger.error(f"Error releasing refresh lock: {e}")
+    
+    def cache_video_details(self, details: Dict[str, Dict[str, Any]], ttl: int = 86400):
+        """Cache details per video ID, so videos shared between searches are only fetched once"""
+        if not self.redis_client or not details:
+            return
+            
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for video_id, video_details in details.items():
+                pipe.setex(f"yt:vd:{video_id}", ttl, _pack(video_details))
+            pipe.execute()
+            logger.debug(f"Cached details for {len(details)} videos")
+            
+        except Exception as e:
+            logger.error(f"Error caching video details: {e}")
+    
+    def get_cached_video_details(self, video_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get cached details for whichever of the video IDs have them, in one MGET"""
+        if not self.redis_client or not video_ids:
+            return {}
+            
+        try:
+            cached = self.redis_client.mget([f"yt:vd:{video_id}" for video_id in video_ids])
+            details = {
+                video_id: _unpack(raw)
+                for video_id, raw in zip(video_ids, cached)
+                if raw is not None
             }
+            logger.debug(f"Retrieved cached details for {len(details)} of {len(video_ids)} videos")
+            return details
+                    
+        except Exception as e:
+            logger.error(f"Error retrieving cached video details: {e}")
             
-            # Cache for 6 hours
-            self.redis_client.setex(
-                skip_key,
-                timedelta(hours=6),
-                json.dumps(skip_data, default=str)
-            )
+        return {}
+    
+    def schedule_queries(self, queries: List[str]):
+        """Add queries to the fetch schedule as due now, keeping already scheduled ones"""
+        if not self.redis_client or not queries:
+            return
+            
+        try:
+            now = time.time()
+            self.redis_client.zadd("queries:queue", {query: now for query in queries}, nx=True)
             
         except Exception as e:
-            logger.error(f"Error marking query processed: {e}")
+            logger.error(f"Error scheduling queries: {e}")
+    
+    def pop_due_query(self) -> Optional[str]:
+        """Pop the query that is due soonest, or None if nothing is due yet"""
+        if not self.redis_client:
+            return None
+            
+        try:
+            popped = self.redis_client.zpopmin("queries:queue")
+            if popped:
+                query, due_at = popped[0]
+                if due_at <= time.time():
+                    return query.decode()
+                    
+                # Not due yet, put it back
+                self.redis_client.zadd("queries:queue", {query: due_at}, nx=True)
+                
+        except Exception as e:
+            logger.error(f"Error popping due query: {e}")
+            
+        return None
+    
+    def reschedule_query(self, query: str, new_videos_count: Optional[int], base_interval: float, max_interval: float = 6 * 3600):
+        """Schedule a query's next fetch, doubling its interval while it finds no new videos
+
+        new_videos_count is None when no API fetch happened (cache hit or error), which keeps
+        the current interval instead of counting as another miss.
+        """
+        if not self.redis_client:
+            return
+            
+        try:
+            if new_videos_count:
+                interval = base_interval
+            else:
+                previous = max(float(self.redis_client.hget("queries:interval", query) or 0), base_interval)
+                interval = previous if new_videos_count is None else min(previous * 2, max_interval)
+                
+            with self.redis_client.pipeline() as pipe:
+                pipe.hset("queries:interval", query, interval)
+                pipe.zadd("queries:queue", {query: time.time() + interval})
+                pipe.execute()
+                
+        except Exception as e:
+            logger.error(f"Error rescheduling query: {e}")
     
     def get_quota_usage(self, api_key_index: int) -> Dict[str, Any]:
         """Get quota usage for specific API key"""
@@ -176,16 +268,29 @@ class CacheService:
             
         try:
             quota_key = f"quota:{api_key_index}:{datetime.utcnow().date()}"
-            quota_data = self.redis_client.get(quota_key)
+            quota_data = self.redis_client.hgetall(quota_key)
             
             if quota_data:
-                return json.loads(str(quota_data))
+                last_updated = quota_data.get(b'last_updated')
+                return {
+                    'calls_today': int(quota_data.get(b'calls_today', 0)),
+                    'quota_exhausted': quota_data.get(b'quota_exhausted') == b'1',
+                    'last_updated': last_updated.decode() if last_updated else None
+                }
                 
         except Exception as e:
             logger.error(f"Error getting quota usage: {e}")
             
         return {'calls_today': 0, 'quota_exhausted': False}
     
+    def _get_next_midnight(self) -> int:
+        """Unix timestamp of the next UTC midnight, recomputed once per day"""
+        today = datetime.utcnow().date()
+        if today != self._midnight_date:
+            self._midnight_date = today
+            self._next_midnight = calendar.timegm((today + timedelta(days=1)).timetuple())
+        return self._next_midnight
+    
     def update_quota_usage(self, api_key_index: int, calls_made: int = 1, quota_exhausted: bool = False):
         """Update quota usage for API key"""
         if not self.redis_client:
@@ -193,21 +298,58 @@ class CacheService:
             
         try:
             quota_key = f"quota:{api_key_index}:{datetime.utcnow().date()}"
-            current_usage = self.get_quota_usage(api_key_index)
-            
-            new_usage = {
-                'calls_today': current_usage['calls_today'] + calls_made,
-                'quota_exhausted': quota_exhausted,
-                'last_updated': datetime.utcnow().isoformat()
-            }
             
-            # Cache until end of day
-            seconds_until_midnight = int((datetime.utcnow().replace(hour=23, minute=59, second=59) - datetime.utcnow()).total_seconds())
-            self.redis_client.setex(quota_key, seconds_until_midnight, json.dumps(new_usage, default=str))
+            # Increment in place and send everything in one round-trip
+            with self.redis_client.pipeline() as pipe:
+                pipe.hincrby(quota_key, 'calls_today', calls_made)
+                pipe.hset(quota_key, mapping={
+                    'quota_exhausted': int(quota_exhausted),
+                    'last_updated': datetime.utcnow().isoformat()
+                })
+                # Cache until end of day
+                pipe.expireat(quota_key, self._get_next_midnight())
+                pipe.execute()
             
         except Exception as e:
             logger.error(f"Error updating quota usage: {e}")
     
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        """Get cached video statistics"""
+        if not self.redis_client:
+            return None
+            
+        try:
+            cached_data = self.redis_client.get("stats:v1")
+            if cached_data:
+                return _unpack(cached_data)
+                
+        except Exception as e:
+            logger.error(f"Error retrieving cached stats: {e}")
+            
+        return None
+    
+    def set_stats(self, stats: Dict[str, Any], ttl: int = 30):
+        """Cache video statistics for a short time"""
+        if not self.redis_client:
+            return
+            
+        try:
+            self.redis_client.setex("stats:v1", ttl, _pack(stats))
+            
+        except Exception as e:
+            logger.error(f"Error caching stats: {e}")
+    
+    def invalidate_stats(self):
+        """Drop cached video statistics after new videos are stored"""
+        if not self.redis_client:
+            return
+            
+        try:
+            self.redis_client.delete("stats:v1")
+            
+        except Exception as e:
+            logger.error(f"Error invalidating cached stats: {e}")
+    
     def clear_cache(self, pattern: str = None):
         """Clear cache entries matching pattern"""
         if not self.redis_client:
@@ -7,7 +7,7 @@ class Video(db.Model):
     video_id = db.Column(db.String(100), unique=True, nullable=False)
     title = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text)
-    published_at = db.Column(db.DateTime, nullable=False, index=True)
+    published_at = db.Column(db.DateTime, nullable=False)  # Indexed by idx_video_pub_id
     thumbnail_default = db.Column(db.String(500))
     thumbnail_medium = db.Column(db.String(500))
     thumbnail_high = db.Column(db.String(500))
@@ -19,27 +19,44 @@ class Video(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'video_id': self.video_id,
-            'title': self.title,
-            'description': self.description,
-            'published_at': self.published_at.isoformat() if self.published_at else None,
+        return rows_to_payload([self])[0]
+
+# Columns needed by rows_to_payload, for read-only queries that skip ORM hydration
+VIDEO_COLUMNS = (
+    Video.id, Video.video_id, Video.title, Video.description, Video.published_at,
+    Video.thumbnail_default, Video.thumbnail_medium, Video.thumbnail_high,
+    Video.channel_id, Video.channel_title, Video.duration, Video.view_count, Video.created_at
+)
+
+def rows_to_payload(rows):
+    """Serialize Video instances or Core rows selected with VIDEO_COLUMNS.
+
+    Datetimes are left as objects for orjson to encode natively.
+    """
+    return [
+        {
+            'id': row.id,
+            'video_id': row.video_id,
+            'title': row.title,
+            'description': row.description,
+            'published_at': row.published_at,
             'thumbnails': {
-                'default': self.thumbnail_default,
-                'medium': self.thumbnail_medium,
-                'high': self.thumbnail_high
+                'default': row.thumbnail_default,
+                'medium': row.thumbnail_medium,
+                'high': row.thumbnail_high
             },
-            'channel_id': self.channel_id,
-            'channel_title': self.channel_title,
-            'duration': self.duration,
-            'view_count': self.view_count,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'channel_id': row.channel_id,
+            'channel_title': row.channel_title,
+            'duration': row.duration,
+            'view_count': row.view_count,
+            'created_at': row.created_at
         }
+        for row in rows
+    ]
 
 class APIKeyUsage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    api_key_hash = db.Column(db.String(64), nullable=False)
+    api_key_hash = db.Column(db.String(64), unique=True, nullable=False)
     quota_used = db.Column(db.Integer, default=0)
     last_reset = db.Column(db.DateTime, default=datetime.utcnow)
     is_exhausted = db.Column(db.Boolean, default=False)
@@ -48,7 +65,7 @@ class APIKeyUsage(db.Model):
 
 class SearchCache(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    query = db.Column(db.String(200), nullable=False, index=True)
+    query = db.Column(db.String(200), unique=True, nullable=False, index=True)
     last_fetched = db.Column(db.DateTime, default=datetime.utcnow)
     total_results = db.Column(db.Integer, default=0)
     next_page_token = db.Column(db.String(100))
@@ -1,6 +1,7 @@
 class YouTubeDashboard {
     constructor() {
-        this.currentPage = 1;
+        this.currentCursor = null;
+        this.cursorHistory = [];
         this.perPage = 20;
         this.currentQuery = '';
         this.isSearchMode = false;
@@ -41,7 +42,6 @@ class YouTubeDashboard {
         // Per page select
         document.getElementById('perPageSelect').addEventListener('change', (e) => {
             this.perPage = parseInt(e.target.value);
-            this.currentPage = 1;
             this.loadVideos();
         });
     }
@@ -110,16 +110,20 @@ class YouTubeDashboard {
         }
     }
 
-    async loadVideos(page = 1) {
+    async loadVideos(cursor = null, history = []) {
         this.showLoading();
-        this.currentPage = page;
+        this.currentCursor = cursor;
+        this.cursorHistory = history;
         
         try {
             let url;
             if (this.isSearchMode && this.currentQuery) {
-                url = `/api/videos/search?q=${encodeURIComponent(this.currentQuery)}&page=${page}&per_page=${this.perPage}`;
+                url = `/api/videos/search?q=${encodeURIComponent(this.currentQuery)}&per_page=${this.perPage}`;
             } else {
-                url = `/api/videos?page=${page}&per_page=${this.perPage}`;
+                url = `/api/videos?per_page=${this.perPage}`;
+            }
+            if (cursor) {
+                url += `&cursor=${encodeURIComponent(cursor)}`;
             }
             
             const response = await fetch(url);
@@ -160,11 +164,15 @@ class YouTubeDashboard {
             
             if (response.ok) {
                 this.showAlert(
-                    `Successfully fetched ${data.total_fetched} videos, stored ${data.stored_count} new videos for query "${data.query}"`,
+                    `Successfully fetched ${data.total_fetched} videos for query "${data.query}"`,
                     'success'
                 );
-                this.loadStats();
-                this.loadVideos();
+                // New videos are stored in the background, so give the write a moment before reloading
+                const reloadDelay = data.fetch_status === 'storing' ? 1000 : 0;
+                setTimeout(() => {
+                    this.loadStats();
+                    this.loadVideos();
+                }, reloadDelay);
             } else {
                 this.showAlert(data.error || 'Error fetching videos', 'danger');
             }
@@ -188,7 +196,6 @@ class YouTubeDashboard {
         
         this.currentQuery = searchQuery;
         this.isSearchMode = true;
-        this.currentPage = 1;
         this.loadVideos();
     }
 
@@ -196,7 +203,6 @@ class YouTubeDashboard {
         document.getElementById('searchInput').value = '';
         this.currentQuery = '';
         this.isSearchMode = false;
-        this.currentPage = 1;
         this.loadVideos();
     }
 
@@ -294,8 +300,9 @@ class YouTubeDashboard {
     renderPagination(pagination) {
         const container = document.getElementById('paginationContainer');
         const list = document.getElementById('paginationList');
+        const hasPrev = this.cursorHistory.length > 0;
         
-        if (!pagination || pagination.pages <= 1) {
+        if (!pagination || (!pagination.has_next && !hasPrev)) {
             container.style.display = 'none';
             return;
         }
@@ -305,10 +312,10 @@ class YouTubeDashboard {
         let paginationHtml = '';
         
         // Previous button
-        if (pagination.has_prev) {
+        if (hasPrev) {
             paginationHtml += `
                 <li class="page-item">
-                    <a class="page-link" href="#" data-page="${pagination.prev_page}">
+                    <a class="page-link" href="#" data-direction="prev">
                         <i class="fas fa-chevron-left"></i>
                     </a>
                 </li>
@@ -323,37 +330,14 @@ class YouTubeDashboard {
             `;
         }
         
-        // Page numbers
-        const startPage = Math.max(1, pagination.page - 2);
-        const endPage = Math.min(pagination.pages, pagination.page + 2);
-        
-        if (startPage > 1) {
-            paginationHtml += `<li class="page-item"><a class="page-link" href="#" data-page="1">1</a></li>`;
-            if (startPage > 2) {
-                paginationHtml += `<li class="page-item disabled"><span class="page-link">...</span></li>`;
-            }
-        }
-        
-        for (let i = startPage; i <= endPage; i++) {
-            if (i === pagination.page) {
-                paginationHtml += `<li class="page-item active"><span class="page-link">${i}</span></li>`;
-            } else {
-                paginationHtml += `<li class="page-item"><a class="page-link" href="#" data-page="${i}">${i}</a></li>`;
-            }
-        }
-        
-        if (endPage < pagination.pages) {
-            if (endPage < pagination.pages - 1) {
-                paginationHtml += `<li class="page-item disabled"><span class="page-link">...</span></li>`;
-            }
-            paginationHtml += `<li class="page-item"><a class="page-link" href="#" data-page="${pagination.pages}">${pagination.pages}</a></li>`;
-        }
+        // Current page number
+        paginationHtml += `<li class="page-item active"><span class="page-link">${this.cursorHistory.length + 1}</span></li>`;
         
         // Next button
         if (pagination.has_next) {
             paginationHtml += `
                 <li class="page-item">
-                    <a class="page-link" href="#" data-page="${pagination.next_page}">
+                    <a class="page-link" href="#" data-direction="next">
                         <i class="fas fa-chevron-right"></i>
                     </a>
                 </li>
@@ -371,11 +355,16 @@ class YouTubeDashboard {
         list.innerHTML = paginationHtml;
         
         // Add click event listeners
-        list.querySelectorAll('a[data-page]').forEach(link => {
+        list.querySelectorAll('a[data-direction]').forEach(link => {
             link.addEventListener('click', (e) => {
                 e.preventDefault();
-                const page = parseInt(e.target.closest('a').getAttribute('data-page'));
-                this.loadVideos(page);
+                const direction = e.target.closest('a').getAttribute('data-direction');
+                if (direction === 'next') {
+                    this.loadVideos(pagination.next_cursor, [...this.cursorHistory, this.currentCursor]);
+                } else {
+                    const history = this.cursorHistory.slice(0, -1);
+                    this.loadVideos(this.cursorHistory[this.cursorHistory.length - 1], history);
+                }
             });
         });
     }
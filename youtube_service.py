@@ -1,13 +1,57 @@
 import os
+import atexit
 import logging
 import hashlib
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from googleapiclient.discovery import build
+import httplib2
+from cachetools import TTLCache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
+from sqlalchemy import text, case, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from models import Video, APIKeyUsage, SearchCache
-from app import db
+from app import app, db
 from cache_service import cache_service
 
+# In-process L1 in front of the Redis search cache for hot queries (TTLCache isn't thread-safe)
+_search_l1 = TTLCache(maxsize=256, ttl=60)
+_search_l1_lock = threading.Lock()
+
+# Redis TTLs: search results go stale quickly, while durations never change and view counts drift slowly
+SEARCH_RESULTS_TTL = 600
+VIDEO_DETAILS_TTL = 86400
+# ETags (with the results they describe) outlive the search results, so later fetches can be conditional
+SEARCH_ETAG_TTL = 6 * 3600
+
+# Once every API key is exhausted, start over from the first key after this long (matches the
+# background fetcher's pause), so fetching resumes after the daily quota reset without a restart
+KEY_EXHAUSTION_COOLDOWN = 3600
+
+# Shared read-only default for missing nested API fields, so lookups don't allocate a dict each time
+_EMPTY = {}
+_NO_DETAILS = {'duration': None, 'view_count': None}
+
+# Columns stored for a fetched video; every row of a multi-row INSERT must carry the same keys
+_VIDEO_FIELDS = (
+    'video_id', 'title', 'description', 'published_at', 'thumbnail_default', 'thumbnail_medium',
+    'thumbnail_high', 'channel_id', 'channel_title', 'duration', 'view_count'
+)
+
+def _thumbnail_url(thumbnails, size):
+    """URL of the thumbnail of the given size, or '' when the API omitted it"""
+    return (thumbnails.get(size) or _EMPTY).get('url', '')
+
+# Parsed once and shared by every per-thread client, instead of build() re-reading and parsing
+# the ~400KB bundled discovery document on each client (re)initialization
+_discovery_document = json.loads(get_static_doc('youtube', 'v3'))
+
 class YouTubeService:
     def __init__(self):
         # Get API keys from environment variables
@@ -28,58 +72,225 @@ class YouTubeService:
         if not self.api_keys:
             logging.warning("No YouTube API keys found in environment variables")
             
+        # Keys are fixed for the process lifetime, so hash them once for usage tracking
+        # (a non-cryptographic lookup key, so the faster BLAKE2b with a 128-bit digest is enough)
+        self.api_key_hashes = [hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest() for api_key in self.api_keys]
+            
         self.current_key_index = 0
-        self.youtube = None
-        self._initialize_youtube_client()
+        self._keys_exhausted_at = None
+        self._key_lock = threading.Lock()
+        # googleapiclient clients aren't thread-safe, so each thread builds its own
+        self._local = threading.local()
+        # Runs videos.list calls so they overlap with database work on the calling thread
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="youtube-details")
+        # Stores fetched videos for callers that don't wait for the stored count
+        self._persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="youtube-persist")
+        # Quota and search-cache writes are applied off the request path by a single worker
+        self._bookkeeping = queue.Queue()
+        threading.Thread(target=self._bookkeeping_loop, daemon=True).start()
+        
+    @property
+    def youtube(self):
+        """YouTube client for the calling thread, rebuilt after an API key switch"""
+        if getattr(self._local, 'key_index', None) != self.current_key_index:
+            return self._initialize_youtube_client()
+        return self._local.youtube
+        
+    def _get_http(self):
+        """Keep-alive HTTP connection for the calling thread, reused across API key switches"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=30)
+        return http
         
     def _initialize_youtube_client(self):
-        """Initialize YouTube client with current API key"""
+        """Initialize YouTube client for the calling thread with current API key"""
+        self._local.youtube = None
+        self._local.key_index = self.current_key_index
         if self.api_keys and self.current_key_index < len(self.api_keys):
             try:
                 api_key = self.api_keys[self.current_key_index]
-                self.youtube = build('youtube', 'v3', developerKey=api_key)
+                self._local.youtube = build_from_document(
+                    _discovery_document, developerKey=api_key, http=self._get_http()
+                )
                 logging.info(f"Initialized YouTube client with API key index {self.current_key_index}")
             except Exception as e:
                 logging.error(f"Failed to initialize YouTube client: {e}")
+        return self._local.youtube
                 
-    def _switch_api_key(self):
+    def _switch_api_key(self, failed_index=None):
         """Switch to next available API key"""
-        self.current_key_index += 1
-        if self.current_key_index < len(self.api_keys):
-            self._initialize_youtube_client()
-            return True
-        return False
+        with self._key_lock:
+            # Another thread already moved past the key that failed for us
+            if failed_index is not None and self.current_key_index != failed_index:
+                return self.current_key_index < len(self.api_keys)
+            self.current_key_index += 1
+            if self.current_key_index >= len(self.api_keys):
+                self._keys_exhausted_at = time.monotonic()
+        return self.current_key_index < len(self.api_keys)
         
-    def _track_api_usage(self, quota_cost=1):
-        """Track API usage for current key"""
+    def _ensure_api_key_available(self):
+        """Raise if every API key is exhausted, wrapping back to the first key after the cooldown"""
+        with self._key_lock:
+            if not self.api_keys or self.current_key_index < len(self.api_keys):
+                return
+            if time.monotonic() - self._keys_exhausted_at >= KEY_EXHAUSTION_COOLDOWN:
+                logging.info("API key exhaustion cooldown over, retrying from the first key")
+                self.current_key_index = 0
+                self._keys_exhausted_at = None
+                return
+        raise Exception("All API keys exhausted")
+        
+    def _fetch_video_details(self, video_ids):
+        """Fetch duration and view count for video IDs (runs on a worker thread)"""
+        return self.youtube.videos().list(
+            part='contentDetails,statistics',
+            id=','.join(video_ids)
+        ).execute()
+        
+    def _commit_async(self):
+        """Commit without waiting for the WAL flush, for bookkeeping rows that may be lost on a crash"""
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+        db.session.commit()
+        
+    def _track_api_usage(self, quota_cost=1, staged=None):
+        """Queue an API usage update for current key, or add it to staged if given"""
         if not self.api_keys or self.current_key_index >= len(self.api_keys):
             return
             
-        api_key = self.api_keys[self.current_key_index]
-        api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        self._stage_bookkeeping(('usage', self.api_key_hashes[self.current_key_index], quota_cost), staged)
         
-        usage = APIKeyUsage.query.filter_by(api_key_hash=api_key_hash).first()
-        if not usage:
-            usage = APIKeyUsage()
-            usage.api_key_hash = api_key_hash
-            db.session.add(usage)
-            
-        # Reset quota if it's a new day
-        if usage.last_reset is None or usage.last_reset.date() < datetime.now().date():
-            usage.quota_used = 0
-            usage.is_exhausted = False
-            usage.last_reset = datetime.now()
-            
-        usage.quota_used += quota_cost
+    def _record_search_cache(self, query, total_results, next_page_token, staged=None):
+        """Queue a search cache update for query, or add it to staged if given"""
+        self._stage_bookkeeping(('search_cache', query, (datetime.utcnow(), total_results, next_page_token)), staged)
+        
+    def _stage_bookkeeping(self, item, staged=None):
+        """Hold item for the caller's own transaction, or hand it to the bookkeeping worker"""
+        if staged is not None:
+            staged.append(item)
+        else:
+            self._bookkeeping.put(item)
+        
+    def flush_bookkeeping(self):
+        """Block until all queued quota and search-cache updates are written"""
+        self._bookkeeping.join()
         
-        # Mark as exhausted if quota exceeds limit (YouTube API has 10,000 units per day)
-        if usage.quota_used >= 9500:  # Leave some buffer
-            usage.is_exhausted = True
+    def _bookkeeping_loop(self):
+        """Write queued updates in batches collected over 200ms (runs on a daemon thread)"""
+        try:
+            with app.app_context():
+                self._migrate_api_key_hashes()
+        except Exception as e:
+            logging.error(f"Error migrating API key hashes: {e}")
             
+        while True:
+            items = [self._bookkeeping.get()]
+            deadline = time.monotonic() + 0.2
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    items.append(self._bookkeeping.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                    
+            try:
+                with app.app_context():
+                    self._apply_bookkeeping(items)
+            except Exception as e:
+                logging.error(f"Error writing API usage and search cache: {e}")
+            finally:
+                for _ in items:
+                    self._bookkeeping.task_done()
+                    
+    def _migrate_api_key_hashes(self):
+        """Carry usage rows recorded under the old SHA-256 key hashes over to the current hashes"""
+        for api_key, api_key_hash in zip(self.api_keys, self.api_key_hashes):
+            db.session.execute(
+                APIKeyUsage.__table__.update()
+                .where(APIKeyUsage.api_key_hash == hashlib.sha256(api_key.encode()).hexdigest())
+                .values(api_key_hash=api_key_hash)
+            )
         db.session.commit()
         
+    def _apply_bookkeeping(self, items, commit=True):
+        """Apply a batch of queued updates in one transaction, left open if commit is False"""
+        usage_costs = {}
+        search_caches = {}
+        for kind, key, value in items:
+            if kind == 'usage':
+                usage_costs[key] = usage_costs.get(key, 0) + value
+            else:
+                search_caches[key] = value  # Latest fetch wins
+                
+        for api_key_hash, quota_cost in usage_costs.items():
+            self._upsert_api_usage(api_key_hash, quota_cost)
+            
+        if search_caches:
+            self._upsert_search_caches(search_caches)
+            
+        if commit:
+            self._commit_async()
+        
+    def _dialect_insert(self, model):
+        """INSERT construct supporting ON CONFLICT for the current database"""
+        insert = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        return insert(model)
+        
+    def _upsert_search_caches(self, search_caches):
+        """Insert or update the SearchCache rows for a batch of queries in one statement"""
+        stmt = self._dialect_insert(SearchCache).values([
+            {
+                'query': query,
+                'last_fetched': fetched_at,
+                'total_results': total_results,
+                'next_page_token': next_page_token
+            }
+            for query, (fetched_at, total_results, next_page_token) in search_caches.items()
+        ])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['query'],
+            set_={
+                'last_fetched': stmt.excluded.last_fetched,
+                'total_results': stmt.excluded.total_results,
+                'next_page_token': stmt.excluded.next_page_token,
+                'updated_at': datetime.utcnow()
+            }
+        ))
+        
+    def _upsert_api_usage(self, api_key_hash, quota_cost):
+        """Add quota_cost to a key's usage in one statement, resetting it on a new day"""
+        now = datetime.now()
+        stmt = self._dialect_insert(APIKeyUsage).values(
+            api_key_hash=api_key_hash,
+            quota_used=quota_cost,
+            last_reset=now,
+            is_exhausted=quota_cost >= 9500
+        )
+        
+        # Reset quota if it's a new day
+        new_day = or_(
+            APIKeyUsage.last_reset.is_(None),
+            APIKeyUsage.last_reset < now.replace(hour=0, minute=0, second=0, microsecond=0)
+        )
+        quota_used = case((new_day, stmt.excluded.quota_used), else_=APIKeyUsage.quota_used + stmt.excluded.quota_used)
+        
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['api_key_hash'],
+            set_={
+                'quota_used': quota_used,
+                'last_reset': case((new_day, stmt.excluded.last_reset), else_=APIKeyUsage.last_reset),
+                # Mark as exhausted if quota exceeds limit (YouTube API has 10,000 units per day)
+                'is_exhausted': quota_used >= 9500,  # Leave some buffer
+                'updated_at': datetime.utcnow()  # UTC like the model defaults; last_reset stays local-day
+            }
+        ))
+        
     def _should_fetch_new_videos(self, query, cache_duration_minutes=10):
-        """Check if we should fetch new videos based on cache"""
+        """Check if we should fetch new videos based on cache
+        
+        cache_duration_minutes must not exceed SEARCH_RESULTS_TTL, or a query would be considered
+        fresh here after its cached results have already expired from Redis.
+        """
         from app import db
         cache = db.session.query(SearchCache).filter(SearchCache.query == query).first()
         if not cache:
@@ -88,36 +299,152 @@ class YouTubeService:
         time_since_last_fetch = datetime.utcnow() - cache.last_fetched
         return time_since_last_fetch > timedelta(minutes=cache_duration_minutes)
         
-    def fetch_videos(self, query="programming", max_results=50, page_token=None):
-        """Fetch videos from YouTube API with Redis caching and fallback API key support"""
+    def _get_cached_search_results(self, query):
+        """Look up cached search results, letting only one worker refresh an expiring query.
+
+        Returns (results, refresh_locked). results is None when the caller should fetch,
+        in which case refresh_locked says whether it holds the refresh lock.
+        """
+        with _search_l1_lock:
+            cached_results = _search_l1.get(query)
+        if cached_results is not None:
+            return cached_results, False
+            
+        cached_results = cache_service.get_cached_search_results(query)
+        if cached_results and not cache_service.should_refresh_early(query):
+            with _search_l1_lock:
+                _search_l1[query] = cached_results
+            return cached_results, False
+            
+        if cache_service.acquire_refresh_lock(query):
+            return None, True
+            
+        # Another worker is refreshing this query, serve whatever is cached meanwhile
+        return cached_results or {'items': []}, False
+        
+    def _get_existing_ids(self, video_ids):
+        """Map the already stored video IDs among video_ids to their primary keys"""
+        if not video_ids:
+            return {}
+        return dict(
+            db.session.query(Video.video_id, Video.id).filter(Video.video_id.in_(video_ids)).all()
+        )
+        
+    def _persist_videos(self, query, videos, existing_ids=None, staged=None, search_etag=None):
+        """Store fetched videos, updating existing rows, and return how many were new
+
+        Staged bookkeeping items are written in the same transaction and cleared once committed.
+        search_etag, a (page_token, etag, result) tuple, is cached only after the commit, so a
+        failed store can't leave later fetches answered by 304s for videos that were never saved.
+        """
+        try:
+            if existing_ids is None:
+                existing_ids = self._get_existing_ids([video['video_id'] for video in videos])
+                
+            # Partition into new rows and updates of existing ones
+            new_videos = []
+            updated_videos = []
+            for video_data in videos:
+                existing_id = existing_ids.get(video_data['video_id'])
+                if existing_id is None:
+                    new_videos.append({field: video_data.get(field) for field in _VIDEO_FIELDS})
+                else:
+                    updated_videos.append({**video_data, 'id': existing_id})
+            
+            if updated_videos:
+                db.session.bulk_update_mappings(Video, updated_videos)
+            
+            stored_count = 0
+            if new_videos:
+                # Single multi-row INSERT; rows stored concurrently by another fetch are skipped
+                result = db.session.execute(
+                    self._dialect_insert(Video).values(new_videos).on_conflict_do_nothing(index_elements=['video_id'])
+                )
+                stored_count = result.rowcount
+                
+            if staged:
+                self._apply_bookkeeping(staged, commit=False)
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+            
+        if staged:
+            staged.clear()
+            
+        if search_etag:
+            page_token, etag, result = search_etag
+            cache_service.cache_search_etag(query, page_token, etag, result, ttl=SEARCH_ETAG_TTL)
+        
+        if stored_count:
+            cache_service.invalidate_stats()
+            with _search_l1_lock:
+                _search_l1.pop(query, None)
+                
+        logging.info(f"Fetched {len(videos)} videos, stored {stored_count} new videos for query: {query}")
+        return stored_count
+        
+    def _persist_videos_in_background(self, query, videos, search_etag=None):
+        """Store fetched videos (runs on the persist worker thread)"""
+        try:
+            with app.app_context():
+                self._persist_videos(query, videos, search_etag=search_etag)
+        except Exception as e:
+            logging.error(f"Error storing videos for query '{query}': {e}")
+            
+    def _cache_first_page(self, query, search_results):
+        """Cache a query's first page of results in Redis and in-process"""
+        cache_service.cache_search_results(query, search_results, ttl=SEARCH_RESULTS_TTL)
+        with _search_l1_lock:
+            _search_l1[query] = search_results
+            
+    def _reuse_unchanged_results(self, query, page_token, result, staged=None):
+        """Serve results YouTube reported unchanged (304) without parsing or storing them again"""
+        if not page_token:
+            self._cache_first_page(query, {'items': result['items'], 'pageInfo': {'totalResults': result['totalResults']}})
+        self._record_search_cache(query, len(result['items']), result['nextPageToken'], staged)
+        logging.info(f"Search results unchanged for query: {query}")
+        return {**result, 'stored_count': 0, 'unchanged': True}
+        
+    def fetch_videos(self, query="programming", max_results=50, page_token=None, wait_for_storage=True, use_cache=True):
+        """Fetch videos from YouTube API with Redis caching and fallback API key support
+
+        With wait_for_storage=False the videos are stored by a worker thread after returning,
+        and stored_count in the result is None. use_cache=False always calls the API (for
+        user-requested fetches), while still caching the new results.
+        """
+        self._ensure_api_key_available()
         if not self.youtube:
             raise Exception("YouTube API client not initialized")
             
+        refresh_locked = False
+        # Quota and search-cache updates for this fetch, committed along with the stored videos
+        # when storing synchronously and otherwise handed to the bookkeeping worker at the end
+        staged = []
         try:
             # Check Redis cache first for recent search results
-            if not page_token:
-                # Check if query should be skipped due to no recent activity
-                if cache_service.should_skip_query(query):
-                    return {"items": [], "nextPageToken": None, "cached": True, "skipped": True}
-                
-                # Try to get cached search results
-                cached_results = cache_service.get_cached_search_results(query)
-                if cached_results:
-                    logging.info(f"Using Redis cached search results for query: {query}")
+            if not page_token and use_cache:
+                # Try to get cached search results, in-process first and then Redis
+                cached_results, refresh_locked = self._get_cached_search_results(query)
+                if cached_results is not None:
+                    logging.info(f"Using cached search results for query: {query}")
                     return {"items": cached_results.get('items', []), "nextPageToken": None, "cached": True}
             
             # Check quota before making API call
-            quota_info = cache_service.get_quota_usage(self.current_key_index)
+            key_index = self.current_key_index
+            quota_info = cache_service.get_quota_usage(key_index)
             if quota_info.get('quota_exhausted', False):
-                logging.warning(f"API key {self.current_key_index} quota already marked as exhausted in cache")
-                if not self._switch_api_key():
+                logging.warning(f"API key {key_index} quota already marked as exhausted in cache")
+                if not self._switch_api_key(key_index):
                     raise Exception("All API keys exhausted")
+                key_index = self.current_key_index
             
             # Calculate publishedAfter timestamp (last 7 days to get recent videos)
             published_after = (datetime.utcnow() - timedelta(days=7)).isoformat() + 'Z'
             
-            # Search for videos
-            search_response = self.youtube.search().list(
+            # Search for videos, letting YouTube answer 304 if nothing changed since the last fetch
+            search_request = self.youtube.search().list(
                 q=query,
                 part='id,snippet',
                 type='video',
@@ -125,9 +452,21 @@ class YouTubeService:
                 publishedAfter=published_after,
                 maxResults=min(max_results, 50),  # YouTube API limit
                 pageToken=page_token
-            ).execute()
+            )
+            last_search = cache_service.get_search_etag(query, page_token)
+            if last_search:
+                search_request.headers['If-None-Match'] = last_search['etag']
+            try:
+                search_response = search_request.execute()
+            except HttpError as e:
+                if e.resp.status != 304 or not last_search:
+                    raise
+                search_response = None
+            
+            self._track_api_usage(100, staged)  # Search costs 100 units
             
-            self._track_api_usage(100)  # Search costs 100 units
+            if search_response is None:
+                return self._reuse_unchanged_results(query, page_token, last_search['result'], staged)
             
             videos = []
             video_ids = []
@@ -139,16 +478,16 @@ class YouTubeService:
                 snippet = search_result['snippet']
                 
                 # Extract thumbnail URLs
-                thumbnails = snippet.get('thumbnails', {})
-                thumbnail_default = thumbnails.get('default', {}).get('url', '')
-                thumbnail_medium = thumbnails.get('medium', {}).get('url', '')
-                thumbnail_high = thumbnails.get('high', {}).get('url', '')
+                thumbnails = snippet.get('thumbnails') or _EMPTY
+                thumbnail_default = _thumbnail_url(thumbnails, 'default')
+                thumbnail_medium = _thumbnail_url(thumbnails, 'medium')
+                thumbnail_high = _thumbnail_url(thumbnails, 'high')
                 
                 video_data = {
                     'video_id': video_id,
                     'title': snippet.get('title', ''),
                     'description': snippet.get('description', ''),
-                    'published_at': datetime.fromisoformat(snippet['publishedAt'].replace('Z', '+00:00')),
+                    'published_at': datetime.fromisoformat(snippet['publishedAt']),  # Parses the 'Z' suffix on 3.11+
                     'thumbnail_default': thumbnail_default,
                     'thumbnail_medium': thumbnail_medium,
                     'thumbnail_high': thumbnail_high,
@@ -158,65 +497,60 @@ class YouTubeService:
                 
                 videos.append(video_data)
             
-            # Get additional video details (duration, view count)
-            if video_ids:
-                video_details = self.youtube.videos().list(
-                    part='contentDetails,statistics',
-                    id=','.join(video_ids)
-                ).execute()
+            # Get additional video details (duration, view count) in the background for videos
+            # not cached from earlier searches, one videos.list call per 50 ids (the API limit)
+            details_map = cache_service.get_cached_video_details(video_ids)
+            missing_ids = [video_id for video_id in video_ids if video_id not in details_map]
+            details_futures = [
+                self._executor.submit(self._fetch_video_details, missing_ids[i:i + 50])
+                for i in range(0, len(missing_ids), 50)
+            ]
+            
+            # Meanwhile look up the primary keys of already stored videos in one query
+            existing_ids = None
+            if wait_for_storage:
+                existing_ids = self._get_existing_ids(video_ids)
+            
+            if details_futures:
+                video_details = [future.result() for future in details_futures]
                 
-                self._track_api_usage(1)  # Videos.list costs 1 unit per video
+                self._track_api_usage(len(details_futures), staged)  # Videos.list costs 1 unit per call
                 
-                # Map details back to videos
-                details_map = {}
-                for video_detail in video_details.get('items', []):
+                fetched_details = {}
+                for video_detail in (item for response in video_details for item in response.get('items', [])):
                     video_id = video_detail['id']
-                    details_map[video_id] = {
-                        'duration': video_detail.get('contentDetails', {}).get('duration', ''),
-                        'view_count': int(video_detail.get('statistics', {}).get('viewCount', 0))
+                    fetched_details[video_id] = {
+                        'duration': video_detail.get('contentDetails', _EMPTY).get('duration', ''),
+                        'view_count': int(video_detail.get('statistics', _EMPTY).get('viewCount', 0))
                     }
+                cache_service.cache_video_details(fetched_details, ttl=VIDEO_DETAILS_TTL)
+                details_map.update(fetched_details)
                 
-                # Update videos with additional details
-                for video in videos:
-                    if video['video_id'] in details_map:
-                        video.update(details_map[video['video_id']])
-            
-            # Store videos in database
-            stored_count = 0
-            for video_data in videos:
-                existing_video = Video.query.filter_by(video_id=video_data['video_id']).first()
-                if not existing_video:
-                    video = Video(**video_data)
-                    db.session.add(video)
-                    stored_count += 1
-                else:
-                    # Update existing video with new information
-                    for key, value in video_data.items():
-                        if key != 'video_id':  # Don't update the ID
-                            setattr(existing_video, key, value)
-            
-            db.session.commit()
+            # Update videos with additional details. Videos videos.list didn't return (deleted or
+            # private by now) get explicit None, since a multi-row INSERT needs the same keys in every row
+            for video in videos:
+                video.update(details_map.get(video['video_id'], _NO_DETAILS))
             
             # Update search cache
-            cache = db.session.query(SearchCache).filter(SearchCache.query == query).first()
-            if not cache:
-                cache = SearchCache()
-                setattr(cache, 'query', query)
-                db.session.add(cache)
-                
-            cache.last_fetched = datetime.utcnow()
-            cache.total_results = len(videos)
-            cache.next_page_token = search_response.get('nextPageToken')
-            db.session.commit()
-            
-            logging.info(f"Fetched {len(videos)} videos, stored {stored_count} new videos for query: {query}")
+            self._record_search_cache(query, len(videos), search_response.get('nextPageToken'), staged)
             
-            return {
+            result = {
                 'items': videos,
                 'nextPageToken': search_response.get('nextPageToken'),
-                'totalResults': search_response.get('pageInfo', {}).get('totalResults', 0),
-                'stored_count': stored_count
+                'totalResults': search_response.get('pageInfo', {}).get('totalResults', 0)
             }
+            search_etag = (page_token, search_response['etag'], result) if search_response.get('etag') else None
+            
+            if wait_for_storage:
+                stored_count = self._persist_videos(query, videos, existing_ids, staged, search_etag)
+            else:
+                self._persist_executor.submit(self._persist_videos_in_background, query, videos, search_etag)
+                stored_count = None
+            
+            if not page_token:
+                self._cache_first_page(query, {'items': videos, 'pageInfo': search_response.get('pageInfo', {})})
+            
+            return {**result, 'stored_count': stored_count}
             
         except HttpError as e:
             error_details = e.resp.get('content', b'').decode('utf-8')
@@ -224,10 +558,13 @@ class YouTubeService:
             
             # Check if quota exhausted
             if e.resp.status == 403 and 'quotaExceeded' in str(e):
-                logging.warning(f"Quota exhausted for API key {self.current_key_index}")
-                if self._switch_api_key():
+                logging.warning(f"Quota exhausted for API key {key_index}")
+                if self._switch_api_key(key_index):
                     logging.info("Switched to next API key, retrying...")
-                    return self.fetch_videos(query, max_results, page_token)
+                    if refresh_locked:
+                        cache_service.release_refresh_lock(query)
+                        refresh_locked = False
+                    return self.fetch_videos(query, max_results, page_token, wait_for_storage, use_cache)
                 else:
                     raise Exception("All API keys exhausted")
             
@@ -236,3 +573,15 @@ class YouTubeService:
         except Exception as e:
             logging.error(f"Error fetching videos: {e}")
             raise
+            
+        finally:
+            if refresh_locked:
+                cache_service.release_refresh_lock(query)
+            # Whatever wasn't committed with the videos (quota spent on a failed fetch too)
+            for item in staged:
+                self._bookkeeping.put(item)
+
+# Shared instance, so API routes and background workers share keep-alive connections and key rotation state
+youtube_service = YouTubeService()
+# The bookkeeping worker is a daemon thread, so write out queued quota usage before the interpreter exits
+atexit.register(youtube_service.flush_bookkeeping)